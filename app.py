@@ -7,238 +7,107 @@ Pattern Worksheet Generator - Final Revision
 - PDF Footer: Grade field reverted to blank (for teacher to write)
 """
 
-from flask import Flask, render_template, request, send_file, jsonify
-import openpyxl
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import mm
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
-from reportlab.lib.styles import ParagraphStyle
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
+from flask import Flask, render_template, request, jsonify
+from flask.json.provider import DefaultJSONProvider
+try:
+    # C 구현 JSON 라이브러리 (선택 설치). 없으면 Flask 기본 json 사용
+    import orjson
+except ImportError:
+    orjson = None
 import os
-import glob
-import random
 from datetime import datetime
+# DB 읽기 / 문항 배분 / PDF 생성은 patterns_core 에 있고 여기는 라우트만 둠
+from patterns_core import list_books, get_book_patterns, get_book_derived, distribute_questions, build_worksheet_bytes
 
-app = Flask(__name__)
-
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-OUTPUT_FOLDER = os.path.join(BASE_DIR, 'outputs')
-DB_FOLDER = os.path.join(BASE_DIR, 'databases')
-
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
-os.makedirs(DB_FOLDER, exist_ok=True)
-
-def setup_korean_font():
-    try:
-        local_font = os.path.join(BASE_DIR, 'fonts', 'NanumGothic.ttf')
-        if os.path.exists(local_font):
-            pdfmetrics.registerFont(TTFont('KoreanFont', local_font))
-            return 'KoreanFont'
-        return 'Helvetica' 
-    except:
-        return 'Helvetica'
+# jsonify / request.json 이 orjson 으로 직렬화/파싱하도록 하는 provider
+class OrjsonProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # indent 등 orjson 에 없는 옵션이 필요한 호출은 기본 구현으로
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default).decode()
 
-KOREAN_FONT = setup_korean_font()
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
-def load_patterns_from_excel(filename):
-    file_path = os.path.join(DB_FOLDER, filename)
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"DB 파일을 찾을 수 없습니다: {filename}")
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default), mimetype=self.mimetype)
 
-    wb = openpyxl.load_workbook(file_path)
-    
-    ws_overview = wb["Pattern Overview"]
-    pattern_info = {}
-    for row in ws_overview.iter_rows(min_row=2, values_only=True):
-        if row[0] is not None:
-            pattern_info[int(row[0])] = {
-                'number': int(row[0]),
-                'name': str(row[1]),
-                'unit': str(row[3]) if len(row) > 3 and row[3] else 'Level A'
-            }
-            
-    ws_detail = wb["Pattern Details"]
-    patterns = {}
-    for row in ws_detail.iter_rows(min_row=2, values_only=True):
+app = Flask(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+
+# 생성한 PDF 를 보관해야 할 때만 환경 변수로 폴더 지정 (기본은 보관하지 않음)
+OUTPUT_FOLDER = os.environ.get('WORKSHEET_OUTPUT_DIR')
+# 보관 폴더가 끝없이 커지지 않도록 최근 파일만 남김 (0 이면 지우지 않음)
+OUTPUT_KEEP = int(os.environ.get('WORKSHEET_OUTPUT_KEEP', 500))
+if OUTPUT_FOLDER:
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+
+# OUTPUT_FOLDER 의 PDF 가 OUTPUT_KEEP 개를 넘으면 오래된 것부터 삭제
+def _prune_outputs():
+    if OUTPUT_KEEP <= 0:
+        return
+    with os.scandir(OUTPUT_FOLDER) as it:
+        entries = [e for e in it if e.name.endswith('.pdf') and e.is_file()]
+    if len(entries) <= OUTPUT_KEEP:
+        return
+    pdfs = []
+    for e in entries:
         try:
-            p_num = int(row[0])
-            section = row[2]
-            content = row[4]
-            answer = row[5] if len(row) > 5 and row[5] else ""
-            
-            if p_num not in patterns:
-                patterns[p_num] = {
-                    'pattern_num': p_num,
-                    'pattern_name': pattern_info.get(p_num, {}).get('name', ''),
-                    'unit': pattern_info.get(p_num, {}).get('unit', 'Level A'),
-                    'speaking1': [], 'speaking2': [], 'unscramble': []
-                }
-            
-            if section == 'Speaking I':
-                patterns[p_num]['speaking1'].append(content)
-            elif section == 'Speaking II':
-                patterns[p_num]['speaking2'].append((content, answer))
-            elif section == 'Unscramble':
-                scrambled = row[6].strip('()') if row[6] else ""
-                patterns[p_num]['unscramble'].append((content, scrambled, answer))
-        except:
+            pdfs.append((e.stat().st_mtime_ns, e.path))
+        except OSError:
+            # scandir 이후 다른 워커가 먼저 지운 경우
             continue
-            
-    return patterns
-
-def distribute_questions(selected_patterns, target_count=5):
-    result = {'speaking1': [], 'speaking2': [], 'unscramble': []}
-    if not selected_patterns: return result
-    
-    pattern_count = len(selected_patterns)
-    items_per = target_count // pattern_count
-    remainder = target_count % pattern_count
-    
-    for section in ['speaking1', 'speaking2', 'unscramble']:
-        for i, p in enumerate(selected_patterns):
-            count = items_per + (1 if i < remainder else 0)
-            pool = p[section][:]
-            random.shuffle(pool)
-            result[section].extend(pool[:count])
-            
-    return result
-
-# --- PDF 생성 (이름/날짜 인자 변경) ---
-def create_worksheet(pattern_data, selected_patterns, output_path, book_title, student_name="", student_date=""):
-    doc = SimpleDocTemplate(
-        output_path,
-        pagesize=A4,
-        topMargin=10*mm,
-        bottomMargin=10*mm,
-        leftMargin=15*mm,
-        rightMargin=15*mm
-    )
-    
-    story = []
-    
-    p_nums = ", ".join([str(p['pattern_num']) for p in selected_patterns])
-    clean_book_title = book_title.replace('.xlsx', '')
-    
-    # Styles
-    title_style = ParagraphStyle('Title', fontSize=12, fontName='Helvetica-Bold', alignment=TA_CENTER, spaceAfter=5)
-    section_style = ParagraphStyle('Section', fontSize=11, fontName='Helvetica-Bold', spaceBefore=0, spaceAfter=0)
-    item_style = ParagraphStyle('Item', fontSize=10, fontName='Helvetica', leftIndent=0, spaceBefore=2, spaceAfter=2)
-    item_kr_style = ParagraphStyle('ItemKr', fontSize=10, fontName=KOREAN_FONT, leftIndent=0, spaceBefore=2, spaceAfter=2)
-    line_style = ParagraphStyle('Line', fontSize=10, fontName='Helvetica', spaceAfter=0)
-    
-    # === PAGE 1: Student Worksheet ===
-    
-    story.append(Paragraph("<b>Weekly Test</b>", title_style))
-    story.append(Paragraph(f"<b>{clean_book_title} - Patterns: {p_nums}</b>", title_style))
-    
-    # 이름과 날짜 처리
-    display_name = f"NAME: {student_name}" if student_name else "NAME: _______________________________"
-    # [수정됨] 날짜가 있으면 출력, 없으면 빈칸
-    display_date = f"DATE: {student_date}" if student_date else "DATE: _____ / _____"
-    
-    name_date_data = [[
-        Paragraph(display_name, ParagraphStyle('Name', fontSize=12, fontName=KOREAN_FONT)), 
-        Paragraph(display_date, ParagraphStyle('Date', fontSize=12, fontName=KOREAN_FONT, alignment=TA_RIGHT)) # 한글 날짜 지원
-    ]]
-    name_date_table = Table(name_date_data, colWidths=[120*mm, 50*mm])
-    name_date_table.setStyle(TableStyle([
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('ALIGN', (0, 0), (0, 0), 'LEFT'),
-        ('ALIGN', (1, 0), (1, 0), 'RIGHT'),
-    ]))
-    story.append(name_date_table)
-    story.append(Spacer(1, 4*mm))
-    
-    # Speaking I
-    story.append(Paragraph("<b>◈ Speaking I - Answer the questions</b>", section_style))
-    story.append(Spacer(1, 2*mm))
-    for idx, question in enumerate(pattern_data['speaking1'][:5], 1):
-        story.append(Paragraph(f"{idx}. {question}", item_style))
-    story.append(Spacer(1, 4*mm))
-    
-    # Speaking II
-    story.append(Paragraph("<b>◈ Speaking II - Say in English</b>", section_style))
-    story.append(Spacer(1, 2*mm))
-    for idx, (korean, answer) in enumerate(pattern_data['speaking2'][:5], 1):
-        story.append(Paragraph(f"{idx}. {korean}", item_kr_style))
-    story.append(Spacer(1, 4*mm))
-    
-    # Speaking III
-    story.append(Paragraph("<b>◈ Speaking III - With your teacher</b>", section_style))
-    story.append(Spacer(1, 2*mm))
-    for idx in range(1, 6):
-        story.append(Paragraph(f"{idx}. Pattern {idx}", item_style))
-    story.append(Spacer(1, 4*mm))
-    
-    # Unscramble
-    story.append(Paragraph("<b>◈ Unscramble</b>", section_style))
-    story.append(Spacer(1, 2*mm))
-    for idx, (korean, words, answer) in enumerate(pattern_data['unscramble'][:5], 1):
-        story.append(Paragraph(f"{idx}. {korean} ({words})", item_kr_style))
-        story.append(Spacer(1, 7*mm)) 
-        story.append(Paragraph("_" * 85, line_style))
-        story.append(Spacer(1, 3*mm))
-    
-    # Footer
-    story.append(Spacer(1, 5*mm))
-    
-    # [수정됨] GRADE는 다시 빈칸으로 복구
-    footer_data = [[
-        Paragraph("<b>GRADE:</b>", ParagraphStyle('Footer', fontSize=12, fontName='Helvetica-Bold')),
-        "",
-        Paragraph("<b>REMARK:</b>", ParagraphStyle('Footer', fontSize=12, fontName='Helvetica-Bold'))
-    ]]
-    footer_table = Table(footer_data, colWidths=[40*mm, 40*mm, 90*mm])
-    footer_table.setStyle(TableStyle([
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('ALIGN', (0, 0), (0, 0), 'LEFT'),
-        ('ALIGN', (2, 0), (2, 0), 'LEFT'),
-    ]))
-    story.append(footer_table)
-    
-    # === PAGE 2: Teacher's Guide ===
-    story.append(PageBreak())
-    
-    story.append(Paragraph("<b>Teacher's Guide (Answer Key)</b>", title_style))
-    story.append(Paragraph(f"<b>{clean_book_title} - Patterns: {p_nums}</b>", title_style))
-    story.append(Spacer(1, 10*mm))
-    
-    story.append(Paragraph("<b>◈ Speaking II Answers</b>", section_style))
-    story.append(Spacer(1, 3*mm))
-    for idx, (korean, answer) in enumerate(pattern_data['speaking2'][:5], 1):
-        story.append(Paragraph(f"<b>{idx}.</b> {answer}", item_style))
-    
-    story.append(Spacer(1, 10*mm))
-    
-    story.append(Paragraph("<b>◈ Unscramble Answers</b>", section_style))
-    story.append(Spacer(1, 3*mm))
-    for idx, (korean, words, answer) in enumerate(pattern_data['unscramble'][:5], 1):
-        story.append(Paragraph(f"<b>{idx}.</b> {answer}", item_style))
+    pdfs.sort()
+    for _, path in pdfs[:-OUTPUT_KEEP]:
+        try:
+            os.remove(path)
+        except OSError:
+            # 다른 워커가 먼저 지운 경우
+            pass
 
-    doc.build(story)
+# 보관용 사본 저장. 실패해도 사용자는 PDF 를 받아야 하므로 로그만 남김
+def _archive_output(filename, pdf_bytes):
+    try:
+        with open(os.path.join(OUTPUT_FOLDER, filename), 'wb') as f:
+            f.write(pdf_bytes)
+        _prune_outputs()
+    except OSError:
+        app.logger.exception("Failed to archive %s", filename)
 
 # --- 라우트 설정 ---
 
+# (books 목록 객체, 렌더링된 HTML). 페이지 내용은 책 목록에만 달려 있으므로 목록이 그대로면 Jinja 렌더링을 건너뜀
+_INDEX_CACHE = {'page': None}
+
 @app.route('/')
 def index():
-    files = glob.glob(os.path.join(DB_FOLDER, "*.xlsx"))
-    books = sorted([os.path.basename(f) for f in files])
-    return render_template('index.html', books=books)
+    books = list_books()
+    # 디버그 모드에서는 템플릿 수정이 바로 보이도록 매번 렌더링
+    if app.debug:
+        return render_template('index.html', books=books)
+    cached = _INDEX_CACHE['page']
+    if cached is None or cached[0] is not books:
+        # 목록과 HTML 을 튜플 하나로 바꿔 넣어 다른 스레드가 어긋난 조합을 보지 않게 함
+        cached = _INDEX_CACHE['page'] = (books, render_template('index.html', books=books))
+    return cached[1]
+
+# /get_patterns 응답 JSON bytes. 책 캐시 항목에 붙여 두므로 파일이 그대로면 직렬화한 응답을 재사용하고,
+# 책이 캐시에서 밀려나면 함께 버려짐
+def _pattern_list_json(patterns):
+    pattern_list = [{'number': p_num, 'name': p['pattern_name'], 'unit': p['unit']}
+                    for p_num, p in sorted(patterns.items())]
+    return app.json.dumps({'success': True, 'patterns': pattern_list}).encode('utf-8')
 
 @app.route('/get_patterns/<filename>')
 def get_patterns(filename):
     try:
-        patterns = load_patterns_from_excel(filename)
-        pattern_list = []
-        for p_num in sorted(patterns.keys()):
-            pattern_list.append({
-                'number': p_num,
-                'name': patterns[p_num]['pattern_name'],
-                'unit': patterns[p_num]['unit']
-            })
-        return jsonify({'success': True, 'patterns': pattern_list})
+        return app.response_class(get_book_derived(filename, 'pattern_list_json', _pattern_list_json),
+                                  mimetype='application/json')
+    except FileNotFoundError as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
@@ -256,23 +125,62 @@ def generate():
         if not book_filename or not selected_nums:
             return jsonify({'error': 'Book or Patterns missing'}), 400
             
-        all_patterns = load_patterns_from_excel(book_filename)
-        selected_data = []
-        for num in selected_nums:
-            if int(num) in all_patterns:
-                selected_data.append(all_patterns[int(num)])
+        # 번호는 한 번만 변환하고, 숫자가 아닌 값이 섞여 있으면 책을 읽기 전에 400 으로 돌려보냄
+        # ("12" 같은 문자열은 글자 단위로 돌면 1, 2 번으로 읽히므로 목록만 받음)
+        if not isinstance(selected_nums, list):
+            return jsonify({'error': 'Invalid pattern number'}), 400
+        # 1.9 처럼 소수 부분이 있는 번호는 잘라서 다른 패턴으로 읽지 않고 거부, 1e400 (inf) 은 int() 가 OverflowError
+        if any(isinstance(num, float) and not num.is_integer() for num in selected_nums):
+            return jsonify({'error': 'Invalid pattern number'}), 400
+        try:
+            nums = [int(num) for num in selected_nums]
+        except (TypeError, ValueError, OverflowError):
+            return jsonify({'error': 'Invalid pattern number'}), 400
+        
+        all_patterns = get_book_patterns(book_filename)
+        selected_data = [all_patterns[num] for num in nums if num in all_patterns]
                 
         final_questions = distribute_questions(selected_data)
         
         filename = f"Worksheet_{datetime.now().strftime('%m%d_%H%M%S')}.pdf"
-        output_path = os.path.join(OUTPUT_FOLDER, filename)
         
-        # [수정됨] create_worksheet 인자 변경
-        create_worksheet(final_questions, selected_data, output_path, book_filename, student_name, student_date)
+        # PDF 는 워커 프로세스에서 만들어 bytes 로 받고, 디스크를 거치지 않고 메모리에서 바로 전송
+        pdf_bytes = build_worksheet_bytes({
+            'pattern_data': final_questions,
+            'selected_patterns': selected_data,
+            'book_title': book_filename,
+            'student_name': student_name,
+            'student_date': student_date,
+        })
+        if OUTPUT_FOLDER:
+            _archive_output(filename, pdf_bytes)
         
-        return send_file(output_path, as_attachment=True)
+        # 이미 bytes 로 다 만들어졌으므로 send_file 의 파일 래퍼 없이 바로 응답 (Content-Length 는 자동으로 붙음)
+        # PDF 는 이미 압축되어 있으므로 전송 단계 압축은 하지 않음
+        return app.response_class(pdf_bytes, mimetype='application/pdf', headers={
+            'Content-Disposition': f'attachment; filename={filename}',
+            'Content-Encoding': 'identity',
+        })
+    except FileNotFoundError as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# 운영 환경에서는 개발 서버 대신 gunicorn 으로 실행 (openpyxl 파싱은 동기 I/O 라 gthread 워커로 충분):
+#   web: gunicorn app:app --workers 4 --worker-class gthread --threads 8 --bind 0.0.0.0:3000
+# (PDF 프로세스 풀은 처음 쓸 때 만들어지므로 --preload 로 import 를 한 번만 해도 됨)
+HOST = '0.0.0.0'
+PORT = 3000
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=3000, debug=True)
\ No newline at end of file
+    if os.environ.get('FLASK_ENV') == 'development':
+        # 코드 수정 시 자동 재시작 + 디버거. 리로더가 모듈을 다시 import 하므로 개발할 때만 사용
+        app.run(host=HOST, port=PORT, debug=True)
+    else:
+        try:
+            # waitress 가 설치돼 있으면 멀티스레드 WSGI 서버로 실행
+            from waitress import serve
+        except ImportError:
+            app.run(host=HOST, port=PORT, debug=False, threaded=True)
+        else:
+            serve(app, host=HOST, port=PORT, threads=8)
\ No newline at end of file
@@ -0,0 +1,722 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pattern Worksheet Generator - core
+- 패턴 DB(xlsx) 읽기 / 캐시, 문항 배분, PDF 생성
+- Flask 에 의존하지 않으므로 PDF 워커 프로세스는 이 모듈만 import 함
+"""
+
+import openpyxl
+try:
+    # Rust 기반 xlsx 리더 (선택 설치). 없으면 openpyxl 사용
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.lib import colors
+from reportlab.platypus import BaseDocTemplate, PageTemplate, Frame, Table, TableStyle, Paragraph, Spacer, PageBreak, KeepTogether
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont, TTFError
+from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
+import io
+import os
+import random
+import copy
+import pickle
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+import threading
+import time
+import logging
+from collections import OrderedDict
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_FOLDER = os.path.join(BASE_DIR, 'databases')
+CACHE_FOLDER = os.path.join(BASE_DIR, '.cache')
+
+os.makedirs(DB_FOLDER, exist_ok=True)
+os.makedirs(CACHE_FOLDER, exist_ok=True)
+
+# 파싱 결과 형식이 바뀌면 올려서 이전 .cache/*.pkl 을 무효화
+PATTERN_CACHE_VERSION = 6
+
+# 한글 글꼴 후보 (앞에서부터 처음 있는 파일을 사용): 프로젝트 fonts/ → Linux → macOS → Windows
+KOREAN_FONT_CANDIDATES = (
+    os.path.join(BASE_DIR, 'fonts', 'NanumGothic.ttf'),
+    '/usr/share/fonts/truetype/nanum/NanumGothic.ttf',
+    '/Library/Fonts/NanumGothic.ttf',
+    'C:/Windows/Fonts/malgun.ttf',
+)
+
+def setup_korean_font():
+    # 리로더 등으로 모듈이 다시 import 돼도 TTF 를 다시 파싱/등록하지 않음
+    try:
+        pdfmetrics.getFont('KoreanFont')
+        return 'KoreanFont'
+    except KeyError:
+        pass
+    for font_path in KOREAN_FONT_CANDIDATES:
+        if not os.path.exists(font_path):
+            continue
+        try:
+            pdfmetrics.registerFont(TTFont('KoreanFont', font_path))
+        except (OSError, TTFError):
+            # 깨진 글꼴 파일이면 다음 후보로
+            continue
+        # 굵은/기울임 글꼴이 따로 없으므로 <b>, <i> 도 같은 글꼴로 매핑해 둠
+        pdfmetrics.registerFontFamily('KoreanFont', normal='KoreanFont', bold='KoreanFont',
+                                      italic='KoreanFont', boldItalic='KoreanFont')
+        return 'KoreanFont'
+    return 'Helvetica'
+
+KOREAN_FONT = setup_korean_font()
+# 아래 스타일들이 이 글꼴 이름을 한 번만 잡아 두므로, 등록이 실제로 됐는지 시작할 때 확인
+assert KOREAN_FONT == 'Helvetica' or KOREAN_FONT in pdfmetrics.getRegisteredFontNames()
+
+# --- PDF 스타일 (요청마다 새로 만들지 않도록 한 번만 생성) ---
+TITLE_STYLE = ParagraphStyle('Title', fontSize=12, fontName='Helvetica-Bold', alignment=TA_CENTER, spaceAfter=5)
+SECTION_STYLE = ParagraphStyle('Section', fontSize=11, fontName='Helvetica-Bold', spaceBefore=0, spaceAfter=0)
+ITEM_STYLE = ParagraphStyle('Item', fontSize=10, fontName='Helvetica', leftIndent=0, spaceBefore=2, spaceAfter=2)
+ITEM_KR_STYLE = ParagraphStyle('ItemKr', fontSize=10, fontName=KOREAN_FONT, leftIndent=0, spaceBefore=2, spaceAfter=2)
+NAME_STYLE = ParagraphStyle('Name', fontSize=12, fontName=KOREAN_FONT)
+DATE_STYLE = ParagraphStyle('Date', fontSize=12, fontName=KOREAN_FONT, alignment=TA_RIGHT) # 한글 날짜 지원
+FOOTER_STYLE = ParagraphStyle('Footer', fontSize=12, fontName='Helvetica-Bold')
+# 한 섹션의 문항을 <br/> 로 묶은 단락용. 줄 간격 = 기본 leading 12 + 문항 사이 간격 2 (전체 높이는 문항별 단락과 동일)
+LIST_STYLE = ParagraphStyle('List', parent=ITEM_STYLE, leading=14, spaceBefore=0)
+LIST_KR_STYLE = ParagraphStyle('ListKr', parent=ITEM_KR_STYLE, leading=14, spaceBefore=0)
+
+# 내용이 항상 같은 단락은 미리 파싱해 두고 PDF마다 얕은 복사본만 넣음
+# (wrap() 이 레이아웃 결과를 객체에 기록하므로 동시 요청끼리 같은 인스턴스를 공유하지 않음)
+SPEAKING3_PARA = Paragraph("<br/>".join(f"{i}. Pattern {i}" for i in range(1, 6)), LIST_STYLE)
+BLANK_NAME_PARA = Paragraph("NAME: _______________________________", NAME_STYLE)
+BLANK_DATE_PARA = Paragraph("DATE: _____ / _____", DATE_STYLE)
+GRADE_PARA = Paragraph("<b>GRADE:</b>", FOOTER_STYLE)
+REMARK_PARA = Paragraph("<b>REMARK:</b>", FOOTER_STYLE)
+
+# 문항 번호 매기기용 포맷 (루프 안에서 f-string 을 매번 새로 해석하지 않도록 미리 바인딩)
+ITEM_FMT = "{0}. {1}".format
+UNSCRAMBLE_FMT = "{0}. {1} ({2})".format
+ANSWER_FMT = "<b>{0}.</b> {1}".format
+
+# 이름/날짜 줄과 GRADE/REMARK 줄의 표 스타일
+NAME_DATE_TABLE_STYLE = TableStyle([
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ('ALIGN', (0, 0), (0, 0), 'LEFT'),
+    ('ALIGN', (1, 0), (1, 0), 'RIGHT'),
+])
+FOOTER_TABLE_STYLE = TableStyle([
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ('ALIGN', (0, 0), (0, 0), 'LEFT'),
+    ('ALIGN', (2, 0), (2, 0), 'LEFT'),
+])
+
+# Unscramble 표: 문제 아래 쓰기 공간(7mm)을 두고 행 아래에 밑줄, 다음 문제와는 3mm 간격
+# (밑줄 길이는 예전 Helvetica 10pt "_" * 85 한 줄과 같게 맞춤. 폭만 필요해서 밑줄 문자열/스타일은 따로 두지 않음)
+# 표는 두 칸으로 두고 문제 단락은 행마다 두 칸을 합쳐 본문 폭 전체에서 줄바꿈, 밑줄은 첫 칸 아래에만 그림
+UNDERLINE_WIDTH = pdfmetrics.stringWidth("_" * 85, 'Helvetica', 10)
+UNSCRAMBLE_TABLE_STYLE = TableStyle([
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ('LEFTPADDING', (0, 0), (-1, -1), 0),
+    ('RIGHTPADDING', (0, 0), (-1, -1), 0),
+    ('TOPPADDING', (0, 0), (-1, 0), 2),
+    ('TOPPADDING', (0, 1), (-1, -1), 3*mm + 4),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 7*mm + 12),
+    ('LINEBELOW', (0, 0), (0, -1), 0.5, colors.black),
+])
+
+# 굵은 제목 단락. 제목 문구는 몇 개 안 되는 고정 문자열이라 (문구, 스타일)별로 한 번만 파싱해 두고 복사본을 돌려줌
+_HEADING_PARAS = {}
+
+def _heading(text, style):
+    para = _HEADING_PARAS.get((text, style.name))
+    if para is None:
+        para = _HEADING_PARAS[(text, style.name)] = Paragraph(f"<b>{text}</b>", style)
+    return copy.copy(para)
+
+# 섹션 제목과 내용을 한 덩어리로 묶어 제목만 페이지 끝에 남지 않게 함
+def build_section(title, *body):
+    return KeepTogether([_heading(title, SECTION_STYLE), Spacer(1, 2*mm), *body])
+
+# 문항 목록을 단락 하나로 만듦 (문항마다 Paragraph 를 만들면 build 때 wrap/split 이 그만큼 늘어남)
+def _numbered_list(lines, style):
+    return Paragraph("<br/>".join(lines), style)
+
+# --- 패턴 DB 캐시 ---
+# filename -> ((mtime_ns, size), patterns, derived). 파일이 바뀌면 stat 값이 달라져 자동으로 다시 읽음
+# derived: 그 책에서 만든 부가 결과(직렬화한 목록 등). 항목과 함께 밀려나므로 따로 캐시를 두지 않음
+# 책이 많아져도 메모리가 무한히 늘지 않도록 최근에 쓴 PATTERN_MEMO_SIZE 권만 유지 (LRU)
+PATTERN_MEMO_SIZE = 16
+_PATTERN_MEMO = OrderedDict()
+# _PATTERN_LOCK: _PATTERN_MEMO / _LOAD_LOCKS 자체를 보호 (짧게만 잡음)
+# _LOAD_LOCKS: 파일별 파싱 잠금 (책 목록에 있는 파일만 들어오므로 개수가 제한됨)
+_PATTERN_LOCK = threading.Lock()
+_LOAD_LOCKS = {}
+
+# 디스크 캐시: .cache/<파일명>.pkl 에 파싱 결과와 원본 xlsx 의 (mtime_ns, size) 를 함께 저장
+# 원본 stat 만 비교하면 되므로 재시작 후에도 xlsx 를 열지 않고 바로 불러옴
+def _disk_cache_path(filename):
+    return os.path.join(CACHE_FOLDER, filename + '.pkl')
+
+def _read_disk_cache(cache_path, stamp):
+    try:
+        with open(cache_path, 'rb') as f:
+            payload = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        return None
+    if (not isinstance(payload, dict) or payload.get('version') != PATTERN_CACHE_VERSION
+            or payload.get('stamp') != stamp):
+        return None
+    return payload['patterns']
+
+def _write_disk_cache(cache_path, stamp, patterns):
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    payload = {'version': PATTERN_CACHE_VERSION, 'stamp': stamp, 'patterns': patterns}
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(payload, f, protocol=5)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+# app.py 라우트에서 쓰는 진입점. 파일이 그대로면 프로세스에 올려둔 결과를 반환
+def get_book_patterns(filename):
+    return _get_book_entry(filename)[0]
+
+# patterns 로부터 만든 값을 key 별로 캐시 항목에 붙여 두고 재사용 (책이 바뀌거나 LRU 에서 밀려나면 함께 버려짐)
+# build(patterns) 는 동시에 두 번 불릴 수 있으므로 같은 입력에 같은 결과를 내야 함
+def get_book_derived(filename, key, build):
+    patterns, derived = _get_book_entry(filename)
+    value = derived.get(key)
+    if value is None:
+        value = derived[key] = build(patterns)
+    return value
+
+# (patterns, derived) 반환
+def _get_book_entry(filename):
+    # 요청에서 온 이름은 databases 폴더 목록에 있는 것만 허용 ('../' 같은 경로는 여기서 걸러짐)
+    if filename not in list_books():
+        raise FileNotFoundError(f"DB 파일을 찾을 수 없습니다: {filename}")
+    file_path = os.path.join(DB_FOLDER, filename)
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"DB 파일을 찾을 수 없습니다: {filename}") from None
+
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _memo_get(filename, stamp)
+    if cached is not None:
+        return cached
+    with _PATTERN_LOCK:
+        load_lock = _LOAD_LOCKS.setdefault(filename, threading.Lock())
+    # 같은 파일을 동시에 요청하면 한 번만 파싱하고, 다른 책의 캐시 조회는 이 파싱을 기다리지 않음
+    with load_lock:
+        cached = _memo_get(filename, stamp)
+        if cached is not None:
+            return cached
+        started = time.perf_counter_ns()
+        patterns = load_patterns_from_excel(filename, stamp)
+        # 캐시 미스에서만 찍히므로, 같은 책에 대해 반복해서 보이면 캐시가 안 맞고 있다는 뜻
+        logger.debug("patterns loaded: %s (%.1f ms)", filename, (time.perf_counter_ns() - started) / 1e6)
+        entry = (patterns, {})
+        with _PATTERN_LOCK:
+            _PATTERN_MEMO[filename] = (stamp, *entry)
+            _PATTERN_MEMO.move_to_end(filename)
+            while len(_PATTERN_MEMO) > PATTERN_MEMO_SIZE:
+                _PATTERN_MEMO.popitem(last=False)
+    return entry
+
+# stamp 가 같은 캐시 항목이 있으면 (patterns, derived), 없으면 None
+def _memo_get(filename, stamp):
+    with _PATTERN_LOCK:
+        cached = _PATTERN_MEMO.get(filename)
+        if cached is not None and cached[0] == stamp:
+            _PATTERN_MEMO.move_to_end(filename)
+            return cached[1:]
+    return None
+
+# stamp: 호출하는 쪽에서 이미 구한 (mtime_ns, size). 없으면 여기서 stat
+def load_patterns_from_excel(filename, stamp=None):
+    file_path = os.path.join(DB_FOLDER, filename)
+    if stamp is None:
+        try:
+            st = os.stat(file_path)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"DB 파일을 찾을 수 없습니다: {filename}") from None
+        stamp = (st.st_mtime_ns, st.st_size)
+
+    cache_path = _disk_cache_path(filename)
+    patterns = _read_disk_cache(cache_path, stamp)
+    if patterns is None:
+        patterns = _parse_workbook(file_path)
+        _write_disk_cache(cache_path, stamp, patterns)
+    return patterns
+
+SHEET_OVERVIEW = "Pattern Overview"
+SHEET_DETAILS = "Pattern Details"
+_ROW_PADDING = (None,) * 7
+# Details 시트의 섹션 이름 -> 패턴 dict 의 키
+SECTION_KEYS = {'Speaking I': 'speaking1', 'Speaking II': 'speaking2', 'Unscramble': 'unscramble'}
+
+# 두 시트의 데이터 행(헤더 제외)을 값 튜플 리스트로 읽어옴
+def _read_sheets_calamine(file_path):
+    wb = CalamineWorkbook.from_path(file_path)
+    try:
+        sheets = []
+        for name in (SHEET_OVERVIEW, SHEET_DETAILS):
+            rows = wb.get_sheet_by_name(name).to_python()
+            # calamine 은 빈 셀을 '' 로 주므로 openpyxl 과 같게 None 으로 맞춤
+            sheets.append([tuple(None if v == '' else v for v in row) for row in rows[1:]])
+        return sheets
+    finally:
+        wb.close()
+
+def _read_sheets_openpyxl(file_path):
+    # read_only 모드: 셀 객체를 만들지 않고 행 단위로 스트리밍 (ZIP 핸들은 close 필요)
+    # keep_links=False: 외부 통합문서 링크 캐시는 읽지 않음
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        return [list(wb[name].iter_rows(min_row=2, values_only=True))
+                for name in (SHEET_OVERVIEW, SHEET_DETAILS)]
+    finally:
+        wb.close()
+
+# --- xlsx XML 직접 읽기 ---
+# 스키마가 고정(값만 필요)이라 openpyxl 의 셀/스타일 객체 없이 sheet XML 을 한 번 훑어서 값만 꺼냄
+_NS_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_NS_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_NS_PKG_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+_TAG_ROW, _TAG_C, _TAG_V, _TAG_T = (_NS_MAIN + t for t in ('row', 'c', 'v', 't'))
+_TAG_SI, _TAG_R, _TAG_IS = (_NS_MAIN + t for t in ('si', 'r', 'is'))
+_TAG_DIMENSION = _NS_MAIN + 'dimension'
+
+def _zip_target(target):
+    # 관계 Target 은 xl/ 기준 상대경로이거나 / 로 시작하는 절대경로
+    if target.startswith('/'):
+        return target[1:]
+    return posixpath.normpath(posixpath.join('xl', target))
+
+def _si_text(si):
+    # 서식 있는 텍스트(<r><t>..</t></r>)는 조각을 이어 붙이고, 발음 표기(<rPh>)는 제외
+    parts = []
+    for child in si:
+        if child.tag == _TAG_T:
+            parts.append(child.text or '')
+        elif child.tag == _TAG_R:
+            parts.extend(t.text or '' for t in child.iter(_TAG_T))
+    return ''.join(parts)
+
+def _col_index(ref):
+    # "C12" -> 2
+    idx = 0
+    for ch in ref:
+        if ch.isdigit():
+            break
+        idx = idx * 26 + (ord(ch) - 64)
+    return idx - 1
+
+def _cell_value(c, shared):
+    t = c.get('t')
+    if t == 'inlineStr':
+        is_ = c.find(_TAG_IS)
+        return _si_text(is_) if is_ is not None else None
+    v = c.find(_TAG_V)
+    if v is None or v.text is None:
+        return None
+    text = v.text
+    if t == 's':
+        return shared[int(text)]
+    if t in ('str', 'e'):
+        return text
+    if t == 'b':
+        return text == '1'
+    # 숫자: openpyxl 처럼 정수면 int, 아니면 float
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+def _iter_sheet_rows(f, shared):
+    # openpyxl read-only 처럼 모든 행을 <dimension> 의 마지막 열까지 None 으로 채움
+    # (끝쪽 빈 셀은 XML 에 아예 없어서, 채우지 않으면 번호만 있는 행은 (2,), 높이만 지정된 빈 행은 () 가 됨)
+    width = 0
+    for _, elem in ET.iterparse(f, events=('end',)):
+        if elem.tag == _TAG_DIMENSION:
+            width = _col_index(elem.get('ref', 'A1').rpartition(':')[2]) + 1
+            continue
+        if elem.tag != _TAG_ROW:
+            continue
+        if elem.get('r') != '1':  # 헤더 행 제외
+            values = []
+            for c in elem.iter(_TAG_C):
+                ref = c.get('r')
+                if ref:
+                    # 빈 셀은 XML 에 없으므로 열 위치에 맞춰 None 으로 채움
+                    col = _col_index(ref)
+                    values.extend([None] * (col - len(values)))
+                values.append(_cell_value(c, shared))
+            if len(values) < width:
+                values.extend([None] * (width - len(values)))
+            yield tuple(values)
+        elem.clear()
+
+def _read_sheets_xml(file_path):
+    with zipfile.ZipFile(file_path) as z:
+        wb_root = ET.fromstring(z.read('xl/workbook.xml'))
+        rel_root = ET.fromstring(z.read('xl/_rels/workbook.xml.rels'))
+        rels = {}
+        shared_path = None
+        for rel in rel_root.iter(_NS_PKG_REL + 'Relationship'):
+            rels[rel.get('Id')] = _zip_target(rel.get('Target'))
+            if rel.get('Type', '').endswith('/sharedStrings'):
+                shared_path = rels[rel.get('Id')]
+        sheet_paths = {sh.get('name'): rels[sh.get(_NS_REL + 'id')]
+                       for sh in wb_root.iter(_NS_MAIN + 'sheet')}
+
+        # 공유 문자열 표는 한 번만 읽어 리스트로 만들어 두고 인덱스로 조회
+        shared = []
+        if shared_path:
+            with z.open(shared_path) as f:
+                for _, elem in ET.iterparse(f, events=('end',)):
+                    if elem.tag == _TAG_SI:
+                        shared.append(_si_text(elem))
+                        elem.clear()
+
+        sheets = []
+        for name in (SHEET_OVERVIEW, SHEET_DETAILS):
+            with z.open(sheet_paths[name]) as f:
+                sheets.append(list(_iter_sheet_rows(f, shared)))
+        return sheets
+
+def _read_sheets(file_path):
+    if CalamineWorkbook is not None:
+        return _read_sheets_calamine(file_path)
+    try:
+        return _read_sheets_xml(file_path)
+    except (KeyError, ValueError, IndexError, ET.ParseError, zipfile.BadZipFile):
+        # 예상과 다른 구조(시트 이름 누락 등)면 openpyxl 로 다시 읽어 같은 오류/결과를 냄
+        return _read_sheets_openpyxl(file_path)
+
+# Unscramble 단어 칸 "(a / b / c)" 의 바깥 괄호 한 쌍만 벗김 (내용 끝의 괄호는 건드리지 않음). 문자열이 아니면 ""
+def _unwrap(s):
+    if not isinstance(s, str):
+        return ""
+    return s[1:-1] if s[:1] == '(' and s[-1:] == ')' else s
+
+# 패턴 번호 칸 값 -> int. 숫자가 아니면(빈 칸, 제목, 메모) None
+# (텍스트 형식으로 저장된 "12" 같은 셀도 번호로 인정)
+def _pattern_num(value):
+    if isinstance(value, str):
+        value = value.strip()
+    elif not isinstance(value, (int, float)):
+        return None
+    try:
+        return int(value)
+    except (ValueError, OverflowError):
+        return None
+
+# info: Overview 시트의 해당 패턴 정보 (없으면 None)
+def _new_pattern(p_num, info):
+    return {
+        'pattern_num': p_num,
+        'pattern_name': info['name'] if info else '',
+        'unit': info['unit'] if info else 'Level A',
+        'speaking1': [], 'speaking2': [], 'unscramble': []
+    }
+
+def _parse_workbook(file_path):
+    overview_rows, detail_rows = _read_sheets(file_path)
+
+    pattern_info = {}
+    for row in overview_rows:
+        # 리더에 따라 끝쪽 빈 칸이 잘린 짧은 행이나 빈 행 () 이 올 수 있으므로 Details 처럼 먼저 채움
+        p_num, name, _, unit = (row + _ROW_PADDING)[:4]
+        # Details 시트와 같은 규칙으로 번호 칸 확인 (제목/메모 행이 섞여 있어도 전체 파싱이 실패하지 않게)
+        p_num = _pattern_num(p_num)
+        if p_num is None:
+            continue
+        # 칸 값은 대부분 이미 문자열이므로 숫자 등일 때만 str() 로 변환
+        if not isinstance(name, str):
+            name = str(name)
+        if not unit:
+            unit = 'Level A'
+        elif not isinstance(unit, str):
+            unit = str(unit)
+        pattern_info[p_num] = {'number': p_num, 'name': name, 'unit': unit}
+
+    patterns = {}
+    get_pattern = patterns.get
+    get_info = pattern_info.get
+    for row in detail_rows:
+        # 빈 칸이 잘린 짧은 행도 있으므로 7칸으로 채운 뒤 한 번에 풀기
+        p_num, _, section, _, content, answer, scrambled_raw = (row + _ROW_PADDING)[:7]
+        # 번호가 없는 행(빈 줄, 메모 등)은 건너뜀
+        p_num = _pattern_num(p_num)
+        if p_num is None:
+            continue
+        answer = answer or ""
+
+        p = get_pattern(p_num)
+        if p is None:
+            p = patterns[p_num] = _new_pattern(p_num, get_info(p_num))
+
+        # 모르는 섹션 이름이나 문항 내용이 빈 행은 무시 (패턴 자체는 위에서 이미 등록됨)
+        key = SECTION_KEYS.get(section)
+        if key is None or content is None:
+            continue
+        if key == 'speaking1':
+            p[key].append(content)
+        elif key == 'speaking2':
+            p[key].append((content, answer))
+        else:
+            p[key].append((content, _unwrap(scrambled_raw), answer))
+
+    return patterns
+
+# rng: random 모듈 또는 random.Random 인스턴스 (재현 가능한 출력이 필요할 때 주입)
+def distribute_questions(selected_patterns, target_count=5, rng=random):
+    if not selected_patterns: return {'speaking1': [], 'speaking2': [], 'unscramble': []}
+    
+    pattern_count = len(selected_patterns)
+    items_per, remainder = divmod(target_count, pattern_count)
+    # 패턴별로 뽑을 개수는 섹션과 무관하므로 한 번만 계산
+    counts = tuple(items_per + (1 if i < remainder else 0) for i in range(pattern_count))
+    sample = rng.sample
+    
+    # 전체를 복사해 섞지 않고 필요한 개수만 비복원 추출 (섹션 순서, 패턴 순서대로 뽑음)
+    return {
+        section: [item for p, count in zip(selected_patterns, counts)
+                  for item in sample(p[section], k=min(count, len(p[section])))]
+        for section in ('speaking1', 'speaking2', 'unscramble')
+    }
+
+# --- 페이지 틀 ---
+# 모든 워크시트가 같은 A4 여백을 쓰므로 본문 영역 좌표는 import 때 한 번만 계산
+PAGE_MARGINS = {'topMargin': 10*mm, 'bottomMargin': 10*mm, 'leftMargin': 15*mm, 'rightMargin': 15*mm}
+_FRAME_RECT = (
+    PAGE_MARGINS['leftMargin'],
+    PAGE_MARGINS['bottomMargin'],
+    A4[0] - PAGE_MARGINS['leftMargin'] - PAGE_MARGINS['rightMargin'],
+    A4[1] - PAGE_MARGINS['topMargin'] - PAGE_MARGINS['bottomMargin'],
+)
+# Frame 기본 좌우 padding(6pt)을 뺀 본문 폭 (일반 단락이 줄바꿈되는 폭)
+_TEXT_WIDTH = _FRAME_RECT[2] - 2 * 6
+
+# SimpleDocTemplate 은 build 할 때마다 First/Later 페이지 템플릿 두 개를 새로 만들지만 여기는 한 종류면 충분.
+# Frame 은 build 중에 현재 위치를 기록하므로 문서마다 새로 만듦 (동시 요청끼리 공유하지 않음)
+class WorksheetDocTemplate(BaseDocTemplate):
+    def __init__(self, output):
+        # 페이지 내용 스트림 FlateDecode 압축 (전역 rl_config 설정과 무관하게 항상 켬)
+        super().__init__(output, pagesize=A4, pageCompression=1, **PAGE_MARGINS)
+        self.addPageTemplates([PageTemplate(id='Worksheet', frames=[Frame(*_FRAME_RECT, id='normal')])])
+
+# --- PDF 생성 (이름/날짜 인자 변경) ---
+# output: 파일 경로 또는 BytesIO 같은 쓰기 가능한 파일 객체
+def create_worksheet(pattern_data, selected_patterns, output, book_title, student_name="", student_date=""):
+    doc = WorksheetDocTemplate(output)
+    
+    story = []
+    # 이 함수 안에서 스무 번 넘게 부르므로 메서드를 지역 이름으로 한 번만 찾아 둠
+    append = story.append
+    
+    p_nums = ", ".join([str(p['pattern_num']) for p in selected_patterns])
+    clean_book_title = book_title.replace('.xlsx', '')
+    
+    # === PAGE 1: Student Worksheet ===
+    
+    # 교재/패턴 제목줄은 두 페이지에 똑같이 들어가므로 한 번만 파싱하고 2쪽에는 복사본을 넣음
+    # (복사는 build 전에 하므로 wrap() 결과를 공유하지 않음)
+    book_title_para = Paragraph(f"<b>{clean_book_title} - Patterns: {p_nums}</b>", TITLE_STYLE)
+    
+    append(_heading("Weekly Test", TITLE_STYLE))
+    append(book_title_para)
+    
+    # 이름과 날짜 처리 (비어 있으면 미리 만들어 둔 빈칸 단락을 복사해 씀)
+    name_para = Paragraph(f"NAME: {student_name}", NAME_STYLE) if student_name else copy.copy(BLANK_NAME_PARA)
+    # [수정됨] 날짜가 있으면 출력, 없으면 빈칸
+    date_para = Paragraph(f"DATE: {student_date}", DATE_STYLE) if student_date else copy.copy(BLANK_DATE_PARA)
+    
+    name_date_data = [[name_para, date_para]]
+    name_date_table = Table(name_date_data, colWidths=[120*mm, 50*mm])
+    name_date_table.setStyle(NAME_DATE_TABLE_STYLE)
+    append(name_date_table)
+    append(Spacer(1, 4*mm))
+    
+    # Speaking I
+    append(build_section("◈ Speaking I - Answer the questions", _numbered_list(
+        [ITEM_FMT(idx, question) for idx, question in enumerate(pattern_data['speaking1'][:5], 1)],
+        LIST_STYLE)))
+    append(Spacer(1, 4*mm))
+    
+    # Speaking II
+    append(build_section("◈ Speaking II - Say in English", _numbered_list(
+        [ITEM_FMT(idx, korean) for idx, (korean, answer) in enumerate(pattern_data['speaking2'][:5], 1)],
+        LIST_KR_STYLE)))
+    append(Spacer(1, 4*mm))
+    
+    # Speaking III
+    append(build_section("◈ Speaking III - With your teacher", copy.copy(SPEAKING3_PARA)))
+    append(Spacer(1, 4*mm))
+    
+    # Unscramble: 밑줄은 "_" 문자열 대신 표의 LINEBELOW 로 그림 (문항 하나 = 표 한 행)
+    unscramble_rows = [[Paragraph(UNSCRAMBLE_FMT(idx, korean, words), ITEM_KR_STYLE), '']
+                       for idx, (korean, words, answer) in enumerate(pattern_data['unscramble'][:5], 1)]
+    if unscramble_rows:
+        unscramble_table = Table(unscramble_rows, colWidths=[UNDERLINE_WIDTH, _TEXT_WIDTH - UNDERLINE_WIDTH], hAlign='LEFT')
+        unscramble_table.setStyle(UNSCRAMBLE_TABLE_STYLE)
+        unscramble_table.setStyle(TableStyle([('SPAN', (0, row), (1, row)) for row in range(len(unscramble_rows))]))
+        append(build_section("◈ Unscramble", unscramble_table, Spacer(1, 3*mm)))
+    else:
+        append(build_section("◈ Unscramble"))
+    
+    # Footer
+    append(Spacer(1, 5*mm))
+    
+    # [수정됨] GRADE는 다시 빈칸으로 복구
+    footer_data = [[copy.copy(GRADE_PARA), "", copy.copy(REMARK_PARA)]]
+    footer_table = Table(footer_data, colWidths=[40*mm, 40*mm, 90*mm])
+    footer_table.setStyle(FOOTER_TABLE_STYLE)
+    append(footer_table)
+    
+    # === PAGE 2: Teacher's Guide ===
+    append(PageBreak())
+    
+    append(_heading("Teacher's Guide (Answer Key)", TITLE_STYLE))
+    append(copy.copy(book_title_para))
+    append(Spacer(1, 10*mm))
+    
+    append(_heading("◈ Speaking II Answers", SECTION_STYLE))
+    append(Spacer(1, 3*mm))
+    append(_numbered_list(
+        [ANSWER_FMT(idx, answer) for idx, (korean, answer) in enumerate(pattern_data['speaking2'][:5], 1)],
+        LIST_STYLE))
+    
+    append(Spacer(1, 10*mm))
+    
+    append(_heading("◈ Unscramble Answers", SECTION_STYLE))
+    append(Spacer(1, 3*mm))
+    append(_numbered_list(
+        [ANSWER_FMT(idx, answer) for idx, (korean, words, answer) in enumerate(pattern_data['unscramble'][:5], 1)],
+        LIST_STYLE))
+
+    doc.build(story)
+
+# --- 여러 장 한꺼번에 생성 ---
+# spec: create_worksheet 인자 중 output 을 뺀 dict
+# (pattern_data, selected_patterns, book_title, student_name, student_date)
+def _build_worksheet_bytes(spec):
+    # ReportLab 은 완성된 PDF 를 write() 한 번으로 넘기므로 버퍼를 미리 키워 둘 필요 없음
+    buf = io.BytesIO()
+    create_worksheet(output=buf, **spec)
+    return buf.getvalue()
+
+# ReportLab 은 GIL 을 거의 놓지 않으므로 스레드 대신 프로세스로 병렬 생성
+# 워커 수는 WORKSHEET_PDF_WORKERS 로 조정 (0 이면 풀 없이 요청 스레드에서 바로 생성).
+# gunicorn 워커를 여러 개 띄울 때는 워커마다 풀이 생기므로 합이 코어 수를 넘지 않게 줄일 것
+PDF_WORKERS = int(os.environ.get('WORKSHEET_PDF_WORKERS', os.cpu_count() or 1))
+PDF_TIMEOUT = 30
+# 이 프로세스에서 풀이 한 번도 일하지 못한 채 깨지면(워커가 아예 못 뜨는 환경) 바로, 일한 적이 있으면
+# 성공 없이 연속 이만큼 깨졌을 때 풀을 영구히 끄고 요청 스레드에서 생성
+# (요청마다 워커 프로세스를 띄웠다 죽이는 일을 반복하지 않도록)
+PDF_POOL_MAX_BREAKS = 3
+_PDF_POOL = None
+_PDF_POOL_LOCK = threading.Lock()
+# ever_worked: 지금까지 어느 풀이든 결과를 한 번이라도 돌려줬는지 / breaks: 성공 없이 연속으로 깨진 횟수
+_PDF_POOL_STATE = {'ever_worked': False, 'breaks': 0, 'disabled': False}
+
+# 풀을 쓸 수 없으면(꺼져 있거나 비활성화됨) None
+def _get_pdf_pool():
+    global _PDF_POOL
+    with _PDF_POOL_LOCK:
+        if _PDF_POOL is None and not _PDF_POOL_STATE['disabled']:
+            # 요청 스레드가 떠 있는 서버 프로세스를 fork 하지 않도록 spawn 사용.
+            # 처음 쓸 때 만들고 계속 재사용 (워커는 import 시 한글 글꼴을 한 번만 등록)
+            # spawn 워커는 patterns_core 를 import 하지만, python app.py 로 실행했다면 app.py 도
+            # __mp_main__ 으로 다시 실행하므로 그 경우에는 워커에도 Flask 가 import 됨
+            _PDF_POOL = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _PDF_POOL
+
+def _pdf_pool_worked():
+    # 평소에는 잠금 없이 바로 빠져나감
+    if _PDF_POOL_STATE['breaks'] or not _PDF_POOL_STATE['ever_worked']:
+        with _PDF_POOL_LOCK:
+            _PDF_POOL_STATE['ever_worked'] = True
+            _PDF_POOL_STATE['breaks'] = 0
+
+# 워커가 죽거나(OOM kill 등) 멈춰 PDF_TIMEOUT 안에 답하지 않으면 풀을 버리고, 다음 요청 때 새 풀을 만듦
+# (위 기준을 넘으면 더는 만들지 않음)
+def _discard_pdf_pool(pool, hung=False):
+    global _PDF_POOL
+    with _PDF_POOL_LOCK:
+        if _PDF_POOL is pool:
+            _PDF_POOL = None
+            _PDF_POOL_STATE['breaks'] += 1
+            if not _PDF_POOL_STATE['ever_worked'] or _PDF_POOL_STATE['breaks'] >= PDF_POOL_MAX_BREAKS:
+                _PDF_POOL_STATE['disabled'] = True
+                logger.warning("PDF worker pool keeps breaking; building PDFs in-process from now on")
+            else:
+                logger.warning("PDF worker pool broke; replacing it on the next request")
+    pool.shutdown(wait=False, cancel_futures=True)
+    if hung:
+        # shutdown 은 실행 중인 작업을 멈추지 못하므로 멈춘 워커는 직접 종료
+        # (3.11 의 ProcessPoolExecutor 에는 워커를 끝내는 공개 API 가 없음)
+        for proc in list((pool._processes or {}).values()):
+            proc.kill()
+
+def build_worksheet_bytes(spec):
+    pool = _get_pdf_pool() if PDF_WORKERS > 0 else None
+    if pool is None:
+        return _build_worksheet_bytes(spec)
+    try:
+        pdf_bytes = pool.submit(_build_worksheet_bytes, spec).result(timeout=PDF_TIMEOUT)
+    except BrokenProcessPool:
+        _discard_pdf_pool(pool)
+        return _build_worksheet_bytes(spec)
+    except TimeoutError:
+        # 같은 입력을 요청 스레드에서 다시 돌려도 멈출 수 있으므로 이 요청은 실패로 돌려보냄
+        _discard_pdf_pool(pool, hung=True)
+        raise
+    _pdf_pool_worked()
+    return pdf_bytes
+
+# 결과는 specs 순서대로 PDF bytes 리스트
+def create_worksheets_batch(specs):
+    specs = list(specs)
+    pool = _get_pdf_pool() if len(specs) > 1 and PDF_WORKERS > 0 else None
+    if pool is None:
+        return [_build_worksheet_bytes(spec) for spec in specs]
+    try:
+        results = list(pool.map(_build_worksheet_bytes, specs, timeout=PDF_TIMEOUT * len(specs)))
+    except BrokenProcessPool:
+        _discard_pdf_pool(pool)
+        return [_build_worksheet_bytes(spec) for spec in specs]
+    except TimeoutError:
+        _discard_pdf_pool(pool, hung=True)
+        raise
+    _pdf_pool_worked()
+    return results
+
+# --- 책 목록 캐시 ---
+# databases 폴더에 파일이 추가/삭제되면 폴더 mtime 이 바뀌므로 그때만 다시 scan
+_BOOKS_CACHE = {'mtime': None, 'books': []}
+
+def list_books():
+    mtime = os.stat(DB_FOLDER).st_mtime_ns
+    if _BOOKS_CACHE['mtime'] != mtime:
+        # scandir 은 경로를 만들었다 basename 으로 자르지 않고 이름을 바로 줌
+        # (glob 의 "*.xlsx" 처럼 . 으로 시작하는 숨김 파일은 제외)
+        with os.scandir(DB_FOLDER) as it:
+            books = sorted(e.name for e in it
+                           if e.name.endswith('.xlsx') and not e.name.startswith('.') and e.is_file())
+        # books 를 먼저 바꿔야 다른 스레드가 새 mtime + 옛 목록 조합을 보지 않음
+        _BOOKS_CACHE['books'] = books
+        _BOOKS_CACHE['mtime'] = mtime
+    return _BOOKS_CACHE['books']